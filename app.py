@@ -1,13 +1,15 @@
+import asyncio
+import functools
+import itertools
 import os
 import tempfile
+import threading
 from dataclasses import dataclass
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Tuple
 
 import gradio as gr
-from openai import OpenAI
-from pypdf import PdfReader, PdfWriter
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import pikepdf
+from openai import AsyncOpenAI
 
 
 # -----------------------------------------------------------------------------
@@ -19,7 +21,7 @@ TEMPLATE_PDF_PATH = "Missouri - InFormaPauperis.pdf"
 
 # Coordinates for each field on each PDF page.
 # IMPORTANT: You must fine-tune these x/y values so they match your exact PDF.
-# reportlab uses points with origin at the bottom-left corner.
+# Values are PDF points with origin at the bottom-left corner.
 # Format: key -> (page_index, x, y)
 PDF_FIELD_POSITIONS = {
     "full_name": (0, 120, 700),
@@ -41,13 +43,27 @@ PDF_FIELD_POSITIONS = {
     "signature_name": (0, 360, 160),
 }
 
+# The mapping baked into (page_index, key, x, y) tuples sorted by page, plus the
+# highest page any field targets. Built once so rendering only walks tuples.
+_POSITIONS_TUPLE: Tuple[Tuple[int, str, float, float], ...] = tuple(
+    sorted(((p_idx, key, x, y) for key, (p_idx, x, y) in PDF_FIELD_POSITIONS.items()), key=lambda t: t[0])
+)
+_MAX_PAGE = _POSITIONS_TUPLE[-1][0] if _POSITIONS_TUPLE else -1
+
+# The same fields grouped by page in page order: page_index -> ((key, x, y), ...).
+PageFields = Tuple[Tuple[str, float, float], ...]
+FIELDS_BY_PAGE: Dict[int, PageFields] = {
+    p_idx: tuple((key, x, y) for _, key, x, y in group)
+    for p_idx, group in itertools.groupby(_POSITIONS_TUPLE, key=lambda t: t[0])
+}
+
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Question:
     key: str
     label: str
     qtype: str  # text, number, radio, multiline, date
-    choices: List[str] | None = None
+    choices: Tuple[str, ...] | None = None
     placeholder: str = ""
 
 
@@ -61,18 +77,18 @@ QUESTIONS: List[Question] = [
         "case_type",
         "Type of case",
         "radio",
-        choices=[
+        choices=(
             "Dissolution of Marriage (Divorce)",
             "Legal Separation",
             "Modification/Post-Decree",
             "Other Family Law",
-        ],
+        ),
     ),
     Question(
         "employment_status",
         "Employment status",
         "radio",
-        choices=["Employed", "Unemployed", "Self-employed", "Disabled", "Retired"],
+        choices=("Employed", "Unemployed", "Self-employed", "Disabled", "Retired"),
     ),
     Question("monthly_income", "Total monthly income (USD)", "number", placeholder="0"),
     Question("cash_on_hand", "Cash on hand (USD)", "number", placeholder="0"),
@@ -96,6 +112,10 @@ QUESTIONS: List[Question] = [
     Question("signature_name", "Type your name as signature", "text", placeholder="Jane Doe"),
 ]
 
+# Position of each question and its progress label, computed once instead of per render.
+_Q_INDEX: Dict[Question, int] = {q: i for i, q in enumerate(QUESTIONS)}
+_PROGRESS_LABELS: Tuple[str, ...] = tuple(f"Question {i + 1} of {len(QUESTIONS)}" for i in range(len(QUESTIONS)))
+
 
 def default_state() -> Dict[str, Any]:
     return {
@@ -109,63 +129,117 @@ def current_question(step: int) -> Question:
     return QUESTIONS[step]
 
 
+def _format_number(n: float) -> str:
+    # Preserve integers cleanly while supporting decimal entries.
+    return str(int(n)) if n.is_integer() else f"{n:.2f}"
+
+
+def _normalize_number(value: Any) -> str:
+    # gr.Number delivers int/float, so handle those without going through str parsing.
+    if isinstance(value, (int, float)):
+        return _format_number(float(value))
+    if isinstance(value, str) and not value.strip():
+        return ""
+    try:
+        return _format_number(float(value))
+    except Exception:
+        return str(value)
+
+
+# qtype -> normalizer; types without an entry are stored as plain strings.
+_NORMALIZERS: Dict[str, Callable[[Any], str]] = {
+    "number": _normalize_number,
+}
+
+
 def normalize_value(value: Any, qtype: str) -> str:
     if value is None:
         return ""
-    if qtype == "number":
-        # Preserve integers cleanly while supporting decimal entries.
+    return _NORMALIZERS.get(qtype, str)(value)
+
+
+# Shared payload for every widget that should be hidden. It carries no "value", which
+# is the only key Gradio pops while applying an update, so reusing it is safe.
+_HIDDEN = gr.update(visible=False)
+
+# Back button states, shared for the same reason. The Next/Finish label is a "value"
+# update that Gradio consumes in place, so that one must still be built per call.
+_BACK_ENABLED = gr.update(interactive=True)
+_BACK_DISABLED = gr.update(interactive=False)
+
+# An empty update leaves a component exactly as it is.
+_UNCHANGED = gr.update()
+
+
+def _text_updates(q: Question, value: str):
+    shown = gr.update(visible=True, label=q.label, value=value, placeholder=q.placeholder)
+    return shown, _HIDDEN, _HIDDEN, _HIDDEN
+
+
+def _number_updates(q: Question, value: str):
+    num_value = None
+    if value != "":
         try:
-            n = float(value)
-            return str(int(n)) if n.is_integer() else f"{n:.2f}"
+            num_value = float(value)
         except Exception:
-            return str(value)
-    return str(value)
+            num_value = None
+    shown = gr.update(visible=True, label=q.label, value=num_value, placeholder=q.placeholder)
+    return _HIDDEN, shown, _HIDDEN, _HIDDEN
+
+
+def _radio_updates(q: Question, value: str):
+    shown = gr.update(visible=True, label=q.label, choices=list(q.choices or ()), value=value or None)
+    return _HIDDEN, _HIDDEN, shown, _HIDDEN
+
+
+def _multiline_updates(q: Question, value: str):
+    shown = gr.update(visible=True, label=q.label, value=value, placeholder=q.placeholder)
+    return _HIDDEN, _HIDDEN, _HIDDEN, shown
+
+
+def _all_hidden_updates(q: Question, value: str):
+    return _HIDDEN, _HIDDEN, _HIDDEN, _HIDDEN
+
+
+# qtype -> (text, number, radio, multiline) update builder.
+_UI_BUILDERS: Dict[str, Callable[[Question, str], tuple]] = {
+    "text": _text_updates,
+    "number": _number_updates,
+    "radio": _radio_updates,
+    "multiline": _multiline_updates,
+}
+
+# qtype -> picks the submitted value from (text, number, radio, multiline).
+_RAW_VAL_PICKERS: Dict[str, Callable[[Any, Any, Any, Any], Any]] = {
+    "text": lambda t, n, r, m: t,
+    "number": lambda t, n, r, m: n,
+    "radio": lambda t, n, r, m: r,
+    "multiline": lambda t, n, r, m: m,
+}
 
 
 def ui_for_question(q: Question, value: str):
     """Create component update payloads so one input widget is shown at a time."""
-    hidden = gr.update(visible=False)
-
-    text_update = hidden
-    number_update = hidden
-    radio_update = hidden
-    multiline_update = hidden
-
-    if q.qtype == "text":
-        text_update = gr.update(visible=True, label=q.label, value=value, placeholder=q.placeholder)
-    elif q.qtype == "number":
-        num_value = None
-        if value != "":
-            try:
-                num_value = float(value)
-            except Exception:
-                num_value = None
-        number_update = gr.update(visible=True, label=q.label, value=num_value, placeholder=q.placeholder)
-    elif q.qtype == "radio":
-        radio_update = gr.update(visible=True, label=q.label, choices=q.choices or [], value=value or None)
-    elif q.qtype == "multiline":
-        multiline_update = gr.update(visible=True, label=q.label, value=value, placeholder=q.placeholder)
-
-    progress = f"Question {QUESTIONS.index(q) + 1} of {len(QUESTIONS)}"
+    build_updates = _UI_BUILDERS.get(q.qtype, _all_hidden_updates)
+    text_update, number_update, radio_update, multiline_update = build_updates(q, value)
+
+    progress = _PROGRESS_LABELS[_Q_INDEX[q]]
     return text_update, number_update, radio_update, multiline_update, progress
 
 
-def save_answer_and_move(state: Dict[str, Any], text_val, number_val, radio_val, multiline_val, delta: int):
-    step = state["step"]
-    q = current_question(step)
-
-    raw_val = ""
-    if q.qtype == "text":
-        raw_val = text_val
-    elif q.qtype == "number":
-        raw_val = number_val
-    elif q.qtype == "radio":
-        raw_val = radio_val
-    elif q.qtype == "multiline":
-        raw_val = multiline_val
+def _save_current_answer(state: Dict[str, Any], text_val, number_val, radio_val, multiline_val) -> None:
+    q = current_question(state["step"])
+
+    picker = _RAW_VAL_PICKERS.get(q.qtype)
+    raw_val = picker(text_val, number_val, radio_val, multiline_val) if picker else ""
 
     state["answers"][q.key] = normalize_value(raw_val, q.qtype)
 
+
+def save_answer_and_move(state: Dict[str, Any], text_val, number_val, radio_val, multiline_val, delta: int):
+    _save_current_answer(state, text_val, number_val, radio_val, multiline_val)
+
+    step = state["step"]
     new_step = max(0, min(step + delta, len(QUESTIONS) - 1))
     state["step"] = new_step
     q2 = current_question(new_step)
@@ -183,7 +257,7 @@ def save_answer_and_move(state: Dict[str, Any], text_val, number_val, radio_val,
         radio_u,
         multi_u,
         prog,
-        gr.update(interactive=can_go_back),
+        _BACK_ENABLED if can_go_back else _BACK_DISABLED,
         gr.update(value="Finish & Generate PDF" if is_last else "Next"),
     )
 
@@ -199,123 +273,205 @@ def start_interview(state: Dict[str, Any]):
         radio_u,
         multi_u,
         prog,
-        gr.update(interactive=False),
+        _BACK_DISABLED,
         gr.update(value="Next"),
         "",
     )
 
 
-def explain_question(state: Dict[str, Any]) -> str:
+# Question labels are static, so an explanation generated once is valid for every
+# user. Keyed by Question.key; failed calls are never stored.
+_EXPLANATION_CACHE: Dict[str, str] = {}
+
+
+@functools.lru_cache(maxsize=1)
+def _openai_client() -> AsyncOpenAI | None:
+    """Build the client once so its HTTP connection pool is reused across clicks."""
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        return "Explanation unavailable: OPENAI_API_KEY is not configured."
+    return AsyncOpenAI(api_key=api_key) if api_key else None
 
-    q = current_question(state["step"])
+
+def _explanation_request(q: Question) -> Dict[str, Any]:
     prompt = (
         "You are a legal information assistant for Missouri family law users. "
         "Explain the following intake question in plain language (2-4 sentences). "
         "Do NOT give legal advice. Keep it practical and neutral.\n\n"
         f"Question: {q.label}"
     )
+    return {
+        "model": "gpt-4o-mini",
+        "temperature": 0.2,
+        "messages": [
+            {"role": "system", "content": "You provide plain-language legal form guidance."},
+            {"role": "user", "content": prompt},
+        ],
+    }
+
+
+async def explain_question(state: Dict[str, Any]) -> str:
+    client = _openai_client()
+    if client is None:
+        return "Explanation unavailable: OPENAI_API_KEY is not configured."
+
+    q = current_question(state["step"])
+    cached = _EXPLANATION_CACHE.get(q.key)
+    if cached is not None:
+        return cached
 
     try:
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.2,
-            messages=[
-                {"role": "system", "content": "You provide plain-language legal form guidance."},
-                {"role": "user", "content": prompt},
-            ],
-        )
-        return response.choices[0].message.content.strip()
+        response = await client.chat.completions.create(**_explanation_request(q))
+        text = response.choices[0].message.content.strip()
     except Exception as e:
         return f"Could not generate explanation right now: {e}"
 
+    _EXPLANATION_CACHE[q.key] = text
+    return text
 
-def create_overlay_pdf(answers: Dict[str, str], num_pages: int) -> str:
-    """Generate an overlay PDF where answers are written at mapped coordinates."""
-    tmp_overlay = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    overlay_path = tmp_overlay.name
-    tmp_overlay.close()
 
-    c = canvas.Canvas(overlay_path, pagesize=letter)
+async def _prewarm_explanations(api_key: str) -> None:
+    """Request every explanation concurrently and store the ones that succeed."""
+    async with AsyncOpenAI(api_key=api_key) as client:
+        responses = await asyncio.gather(
+            *(client.chat.completions.create(**_explanation_request(q)) for q in QUESTIONS),
+            return_exceptions=True,
+        )
+    for q, response in zip(QUESTIONS, responses):
+        if isinstance(response, BaseException):
+            continue
+        content = response.choices[0].message.content
+        if content:
+            _EXPLANATION_CACHE.setdefault(q.key, content.strip())
 
-    for page_index in range(num_pages):
-        for key, (p_idx, x, y) in PDF_FIELD_POSITIONS.items():
-            if p_idx != page_index:
-                continue
-            value = answers.get(key, "")
-            if value:
-                c.setFont("Helvetica", 10)
-                c.drawString(x, y, value)
-        c.showPage()
 
-    c.save()
-    return overlay_path
+def start_explanation_prewarm() -> None:
+    """Fill the explanation cache in the background so the first click is instant."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return
+    threading.Thread(
+        target=lambda: asyncio.run(_prewarm_explanations(api_key)),
+        name="explanation-prewarm",
+        daemon=True,
+    ).start()
 
 
-def fill_pdf(answers: Dict[str, str]) -> str:
+def _pdf_literal(value: str) -> bytes:
+    """Encode `value` as the body of a PDF (...) string for a WinAnsi-encoded font."""
+    return (
+        value.encode("cp1252", "replace")
+        .replace(b"\\", b"\\\\")
+        .replace(b"(", b"\\(")
+        .replace(b")", b"\\)")
+        .replace(b"\r", b"\\r")
+        .replace(b"\n", b"\\n")
+    )
+
+
+def _add_helvetica(pdf: pikepdf.Pdf) -> pikepdf.Object:
+    """Create one indirect Helvetica font object that every page of `pdf` can share."""
+    return pdf.make_indirect(
+        pikepdf.Dictionary(
+            Type=pikepdf.Name.Font,
+            Subtype=pikepdf.Name.Type1,
+            BaseFont=pikepdf.Name.Helvetica,
+            Encoding=pikepdf.Name.WinAnsiEncoding,
+        )
+    )
+
+
+def draw_answers(
+    page: pikepdf.Page,
+    font: pikepdf.Object,
+    fields: PageFields,
+    answers: Dict[str, str],
+) -> None:
+    """Write answers straight into a page's content stream at mapped coordinates."""
+    filled = [(x, y, answers[key]) for key, x, y in fields if answers.get(key, "")]
+    if not filled:
+        return
+
+    font_name = str(page.add_resource(font, pikepdf.Name.Font, prefix="IFP")).encode()
+
+    # Close the q opened before the original content, then draw every field in one
+    # text object. Tm positions each string absolutely in default PDF coordinates.
+    stream = bytearray(b"\nQ\nBT\n%s 10 Tf\n" % font_name)
+    for x, y, value in filled:
+        stream += b"1 0 0 1 %.2f %.2f Tm (%s) Tj\n" % (x, y, _pdf_literal(value))
+    stream += b"ET\n"
+
+    # Wrap the original content in q ... Q so its graphics state cannot leak into our text.
+    page.contents_add(b"q\n", prepend=True)
+    page.contents_add(bytes(stream))
+
+
+_OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
+@functools.lru_cache(maxsize=1)
+def _get_template_pdf() -> pikepdf.Pdf:
+    """Open the template once; it does not change while the app is running."""
     if not os.path.exists(TEMPLATE_PDF_PATH):
         raise FileNotFoundError(
             f"Template PDF not found at '{TEMPLATE_PDF_PATH}'. "
             "Place the IFP form in the repository and update TEMPLATE_PDF_PATH if needed."
         )
+    return pikepdf.open(TEMPLATE_PDF_PATH)
 
-    template_reader = PdfReader(TEMPLATE_PDF_PATH)
-    num_pages = len(template_reader.pages)
 
-    overlay_path = create_overlay_pdf(answers, num_pages)
-    overlay_reader = PdfReader(overlay_path)
+@functools.lru_cache(maxsize=1)
+def _drawable_pages() -> Tuple[Tuple[int, PageFields], ...]:
+    """Pages that both exist in the template and have mapped fields, in page order."""
+    num_pages = len(_get_template_pdf().pages)
+    if _MAX_PAGE < num_pages:
+        return tuple(FIELDS_BY_PAGE.items())
+    return tuple((p_idx, fields) for p_idx, fields in FIELDS_BY_PAGE.items() if p_idx < num_pages)
 
-    writer = PdfWriter()
-    for i in range(num_pages):
-        base_page = template_reader.pages[i]
-        if i < len(overlay_reader.pages):
-            base_page.merge_page(overlay_reader.pages[i])
-        writer.add_page(base_page)
 
-    output_file = tempfile.NamedTemporaryFile(delete=False, suffix="_ifp_completed.pdf")
-    output_path = output_file.name
-    output_file.close()
+def fill_pdf(answers: Dict[str, str]) -> str:
+    template = _get_template_pdf()
+
+    with pikepdf.new() as out:
+        # Draw on the copies in `out`, so the cached template stays blank.
+        out.pages.extend(template.pages)
+        font = _add_helvetica(out)
+        for page_index, fields in _drawable_pages():
+            draw_answers(out.pages[page_index], font, fields, answers)
 
-    with open(output_path, "wb") as f:
-        writer.write(f)
+        # pikepdf writes the serialized objects in many small chunks; a large buffer
+        # coalesces them into a handful of write syscalls.
+        with tempfile.NamedTemporaryFile(delete=False, suffix="_ifp_completed.pdf", buffering=_OUTPUT_BUFFER_SIZE) as f:
+            out.save(f)
 
-    return output_path
+    return f.name
 
 
 def on_next_or_finish(state: Dict[str, Any], text_val, number_val, radio_val, multiline_val):
-    at_last = state["step"] == len(QUESTIONS) - 1
-    (
-        state,
-        text_u,
-        num_u,
-        radio_u,
-        multi_u,
-        prog,
-        back_u,
-        next_u,
-    ) = save_answer_and_move(state, text_val, number_val, radio_val, multiline_val, delta=(0 if at_last else 1))
+    if state["step"] != len(QUESTIONS) - 1:
+        moved = save_answer_and_move(state, text_val, number_val, radio_val, multiline_val, delta=1)
+        return (*moved, gr.update(value=None, visible=False), "")
 
-    download_update = gr.update(value=None, visible=False)
-    status = ""
+    # Finishing stays on the last question, so only the answer is saved and the
+    # question widgets, progress and buttons are left as they are.
+    _save_current_answer(state, text_val, number_val, radio_val, multiline_val)
 
-    if at_last:
-        try:
-            output_path = fill_pdf(state["answers"])
-            download_update = gr.update(value=output_path, visible=True)
-            status = "PDF generated successfully. Review and sign where required before filing."
-        except Exception as e:
-            status = f"Could not generate PDF: {e}"
+    try:
+        output_path = fill_pdf(state["answers"])
+        download_update = gr.update(value=output_path, visible=True)
+        status = "PDF generated successfully. Review and sign where required before filing."
+    except Exception as e:
+        download_update = gr.update(value=None, visible=False)
+        status = f"Could not generate PDF: {e}"
 
-    return state, text_u, num_u, radio_u, multi_u, prog, back_u, next_u, download_update, status
+    return (state, *(_UNCHANGED,) * 7, download_update, status)
 
 
 def on_back(state: Dict[str, Any], text_val, number_val, radio_val, multiline_val):
     return save_answer_and_move(state, text_val, number_val, radio_val, multiline_val, delta=-1)
 
 
+start_explanation_prewarm()
+
+
 with gr.Blocks(title="Missouri IFP Guided Interview") as demo:
     gr.Markdown(
         """
@@ -327,7 +483,7 @@ It is for **information and form preparation**, not legal advice.
 
     state = gr.State(default_state())
 
-    progress = gr.Markdown("Question 1 of 17")
+    progress = gr.Markdown(_PROGRESS_LABELS[0])
 
     text_input = gr.Textbox(visible=False)
     number_input = gr.Number(visible=False)